@@ -1,3 +1,8 @@
+import json
+import random
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import xmlschema
 
@@ -99,3 +104,378 @@ def test_add_geotransform_invalid():
     vrt.add_vrtdataset(8, 8)
     with pytest.raises(ValueError):
         vrt.add_geotransform(tuple())
+
+
+def test_concurrent_add_source_and_metadata():
+    def build(order):
+        vrt = VRTWriter(concurrent=True)
+        vrt.add_vrtdataset(8, 8)
+        for band in range(1, 5):
+            vrt.add_vrtrasterband(band)
+
+        def work(i):
+            band = i % 4 + 1
+            vrt.add_source(band, f"/vsimem/{i}.tif", 1, order=i)
+            vrt.add_metadata({"index": str(i)}, domain=f"domain_{i}", order=i)
+            vrt.add_metadata(
+                {"index": str(i)}, domain=f"domain_{i}", band=band, order=i
+            )
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            list(executor.map(work, order))
+        vrt.flush()
+
+        return vrt
+
+    order = list(range(400))
+    expected = build(order)
+    random.Random(0).shuffle(order)
+    actual = build(order)
+
+    assert actual.is_valid
+    assert len(actual.vrt["Metadata"]) == 400
+    for band in actual.vrt["VRTRasterBand"]:
+        assert len(band["Metadata"]) == 100
+        filenames = [s["SourceFilename"]["$"] for s in band["SimpleSource"]]
+        assert filenames == [
+            f"/vsimem/{i}.tif" for i in range(band["@band"] - 1, 400, 4)
+        ]
+    assert actual.vrt == expected.vrt
+
+
+def test_concurrent_add_source_mosaic():
+    vrt = VRTWriter(concurrent=True)
+    vrt.add_vrtdataset(8, 8)
+    vrt.add_vrtrasterband(1)
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(
+            executor.map(
+                lambda i: vrt.add_source(1, f"/vsimem/{i}.tif", 1, order=-i),
+                range(1000),
+            )
+        )
+    vrt.flush()
+
+    sources = vrt.vrt["VRTRasterBand"][0]["SimpleSource"]
+    filenames = [s["SourceFilename"]["$"] for s in sources]
+    assert filenames == [f"/vsimem/{i}.tif" for i in reversed(range(1000))]
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_source_and_metadata_order(concurrent):
+    vrt = VRTWriter(concurrent=concurrent)
+    vrt.add_vrtdataset(8, 8)
+    vrt.add_vrtrasterband(1)
+    for filename in ("z.tif", "a.tif", "m.tif"):
+        vrt.add_source(1, filename, 1)
+    vrt.add_source(1, "b.tif", 1, order=-1)
+    vrt.add_metadata({"k": "new"}, domain="d")
+    vrt.add_metadata({"k": "a-old"}, domain="d")
+    vrt.add_metadata({"k": "last"}, domain="e", order=1)
+    vrt.add_metadata({"k": "first"}, domain="e")
+    vrt.flush()
+
+    sources = vrt.vrt["VRTRasterBand"][0]["SimpleSource"]
+    filenames = [s["SourceFilename"]["$"] for s in sources]
+    assert filenames == ["b.tif", "a.tif", "m.tif", "z.tif"]
+    assert vrt.vrt["Metadata"] == [
+        {"@domain": "d", "MDI": [{"@key": "k", "$": "new"}]},
+        {"@domain": "e", "MDI": [{"@key": "k", "$": "last"}]},
+    ]
+
+
+def test_serial_matches_concurrent():
+    def build(concurrent):
+        vrt = VRTWriter(concurrent=concurrent)
+        vrt.add_vrtdataset(8, 8)
+        vrt.add_vrtrasterband(1)
+        vrt.add_source(1, "a.tif", 1)
+        vrt.add_source(1, "b.tif", 1)
+        vrt.add_source(1, "c.tif", 2, order=-1)
+        vrt.add_metadata({"k": "v"}, band=1)
+
+        return vrt.to_string()
+
+    assert build(False) == build(True)
+
+
+def test_concurrent_without_order_is_deterministic():
+    def build(submission):
+        vrt = VRTWriter(concurrent=True)
+        vrt.add_vrtdataset(8, 8)
+        for band in range(1, 5):
+            vrt.add_vrtrasterband(band)
+
+        def work(i):
+            vrt.add_source(i % 4 + 1, f"/vsimem/{i % 50}.tif", 1)
+            vrt.add_metadata({"index": str(i)}, domain=f"domain_{i % 50}")
+            if i % 20 == 0:
+                vrt.flush()
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            list(executor.map(work, submission))
+
+        return vrt.to_string()
+
+    submission = list(range(400))
+    expected = build(submission)
+    for seed in range(3):
+        random.Random(seed).shuffle(submission)
+        assert build(submission) == expected
+
+
+def test_concurrent_contention():
+    vrt = VRTWriter(concurrent=True)
+    vrt.add_vrtdataset(8, 8)
+    for band in range(1, 5):
+        vrt.add_vrtrasterband(band)
+
+    def work(i):
+        band = i % 4 + 1
+        kind = i % 5
+        if kind == 0:
+            vrt.flush()
+            assert vrt.to_string()
+        elif kind == 1:
+            vrt.add_vrtrasterband(100 + i)
+        elif kind == 2:
+            vrt.add_nodata(band, 0)
+            vrt.add_description(band, f"band {i}")
+        else:
+            vrt.add_source(band, f"/vsimem/{i}.tif", 1)
+            vrt.add_metadata({"index": str(i)}, domain=f"domain_{i}", band=band)
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(work, range(2000)))
+    vrt.flush()
+
+    added = [i for i in range(2000) if i % 5 in (3, 4)]
+    bands = {band["@band"]: band for band in vrt.vrt["VRTRasterBand"]}
+    assert set(bands) == set(range(1, 5)) | {100 + i for i in range(1, 2000, 5)}
+    for index in range(1, 5):
+        band = bands[index]
+        expected = sorted(i for i in added if i % 4 + 1 == index)
+        filenames = [s["SourceFilename"]["$"] for s in band["SimpleSource"]]
+        assert filenames == sorted(f"/vsimem/{i}.tif" for i in expected)
+        domains = [m["@domain"] for m in band["Metadata"]]
+        assert domains == sorted(f"domain_{i}" for i in expected)
+        assert band["NoDataValue"] == {"$": 0.0}
+
+
+def test_concurrent_add_source_invalid_band():
+    vrt = VRTWriter(concurrent=True)
+    vrt.add_vrtdataset(8, 8)
+    vrt.add_vrtrasterband(1)
+
+    with pytest.raises(ValueError):
+        vrt.add_source(2, "/vsimem/test.tif", 1)
+
+
+def create_mosaic(relative=False):
+    vrt = VRTWriter()
+    vrt.add_vrtdataset(16, 16)
+    vrt.add_geotransform((-123.0, 0.5, 0.0, 49.0, 0.0, -0.5))
+    vrt.add_vrtrasterband(1)
+    for i, (xoff, yoff) in enumerate(((0, 0), (8, 0), (0, 8), (8, 8))):
+        vrt.add_source(
+            1,
+            f"{i}.tif",
+            1,
+            src_win_xoff=0,
+            src_win_yoff=0,
+            src_win_xsize=16,
+            src_win_ysize=16,
+            dst_win_xoff=xoff,
+            dst_win_yoff=yoff,
+            dst_win_xsize=8,
+            dst_win_ysize=8,
+            relative=relative,
+        )
+
+    return vrt
+
+
+def read_tile_sources(path):
+    return [
+        (
+            source.find("SourceFilename").text,
+            {k: float(v) for k, v in source.find("SrcRect").attrib.items()},
+            {k: float(v) for k, v in source.find("DstRect").attrib.items()},
+        )
+        for source in ET.parse(path).getroot().iter("SimpleSource")
+    ]
+
+
+def test_to_tiles(tmp_path):
+    vrt = create_mosaic()
+
+    index = vrt.to_tiles(tmp_path, 6, 6)
+
+    with tmp_path.joinpath("index.json").open() as f:
+        written = json.load(f)
+    assert written["rasterXSize"] == 16
+    assert written["rasterYSize"] == 16
+    assert written["tiles"] == index
+    assert len(index) == 9
+    assert [entry["filename"] for entry in index[:4]] == [
+        "tile_0_0.vrt",
+        "tile_0_1.vrt",
+        "tile_0_2.vrt",
+        "tile_1_0.vrt",
+    ]
+    edge = index[8]
+    assert (edge["xoff"], edge["yoff"], edge["xsize"], edge["ysize"]) == (12, 12, 4, 4)
+    assert index[4]["geotransform"] == [-120.0, 0.5, 0.0, 46.0, 0.0, -0.5]
+
+    root = ET.parse(tmp_path.joinpath("tile_2_2.vrt")).getroot()
+    assert root.attrib == {"rasterXSize": "4", "rasterYSize": "4"}
+    assert root.find("GeoTransform").text == "-117.0, 0.5, 0.0, 43.0, 0.0, -0.5"
+
+    assert read_tile_sources(tmp_path.joinpath("tile_0_0.vrt")) == [
+        (
+            "0.tif",
+            {"xOff": 0, "yOff": 0, "xSize": 12, "ySize": 12},
+            {"xOff": 0, "yOff": 0, "xSize": 6, "ySize": 6},
+        )
+    ]
+    centre = read_tile_sources(tmp_path.joinpath("tile_1_1.vrt"))
+    filenames = [filename for filename, _, _ in centre]
+    assert filenames == ["0.tif", "1.tif", "2.tif", "3.tif"]
+    assert centre[0][1:] == (
+        {"xOff": 12, "yOff": 12, "xSize": 4, "ySize": 4},
+        {"xOff": 0, "yOff": 0, "xSize": 2, "ySize": 2},
+    )
+    assert centre[3][1:] == (
+        {"xOff": 0, "yOff": 0, "xSize": 8, "ySize": 8},
+        {"xOff": 2, "yOff": 2, "xSize": 4, "ySize": 4},
+    )
+
+
+def test_to_tiles_relative(tmp_path):
+    vrt = create_mosaic(relative=True)
+
+    with pytest.raises(ValueError):
+        vrt.to_tiles(tmp_path.joinpath("tiles"), 8, 8)
+
+    vrt.to_tiles(tmp_path.joinpath("tiles"), 8, 8, vrt_path=tmp_path.joinpath("a.vrt"))
+
+    sources = read_tile_sources(tmp_path.joinpath("tiles", "tile_1_1.vrt"))
+    assert [filename for filename, _, _ in sources] == ["../3.tif"]
+
+
+def test_to_tiles_mask_band(tmp_path):
+    vrt = create_mosaic()
+    mask = VRTWriter()
+    mask.add_vrtrasterband(1)
+    mask.add_source(
+        1,
+        "mask.tif",
+        1,
+        src_xsize=32,
+        src_ysize=32,
+        src_dtype="Byte",
+        src_block_xsize=32,
+        src_block_ysize=1,
+    )
+    vrt.flush()
+    band = vrt.vrt["VRTRasterBand"][0]
+    band["MaskBand"] = {"VRTRasterBand": mask.vrt["VRTRasterBand"]}
+
+    vrt.to_tiles(tmp_path, 8, 8)
+
+    root = ET.parse(tmp_path.joinpath("tile_0_1.vrt")).getroot()
+    rect = root.find("VRTRasterBand/MaskBand/VRTRasterBand/SimpleSource/SrcRect")
+    assert rect.attrib == {
+        "xOff": "16.0",
+        "yOff": "0.0",
+        "xSize": "16.0",
+        "ySize": "16.0",
+    }
+
+
+def test_to_tiles_skips_empty_dst_rect(tmp_path):
+    vrt = VRTWriter()
+    vrt.add_vrtdataset(16, 16)
+    vrt.add_vrtrasterband(1)
+    vrt.add_source(
+        1,
+        "a.tif",
+        1,
+        src_win_xoff=0,
+        src_win_yoff=0,
+        src_win_xsize=16,
+        src_win_ysize=16,
+        dst_win_xoff=1,
+        dst_win_yoff=1,
+        dst_win_xsize=0,
+        dst_win_ysize=0,
+    )
+
+    vrt.to_tiles(tmp_path, 8, 8)
+
+    assert read_tile_sources(tmp_path.joinpath("tile_0_0.vrt")) == []
+
+
+def test_to_tiles_unclippable(tmp_path):
+    vrt = VRTWriter()
+    vrt.add_vrtdataset(16, 16)
+    vrt.add_vrtrasterband(1)
+    vrt.add_source(1, "a.tif", 1)
+    with pytest.raises(ValueError):
+        vrt.to_tiles(tmp_path, 8, 8)
+
+    vrt = VRTWriter()
+    vrt.add_vrtdataset(16, 16)
+    vrt.add_vrtrasterband(1)
+    vrt.add_source(1, "a.tif", 1, type="KernelFiltered", src_xsize=16, src_ysize=16)
+    with pytest.raises(ValueError):
+        vrt.to_tiles(tmp_path, 8, 8)
+
+
+@pytest.mark.parametrize(
+    "dataset_subclass, band_subclass",
+    [("VRTWarpedDataset", None), (None, "VRTRawRasterBand")],
+)
+def test_to_tiles_unsupported_subclass(tmp_path, dataset_subclass, band_subclass):
+    vrt = VRTWriter()
+    vrt.add_vrtdataset(16, 16, subclass=dataset_subclass)
+    vrt.add_vrtrasterband(1, subclass=band_subclass)
+
+    with pytest.raises(ValueError):
+        vrt.to_tiles(tmp_path, 8, 8)
+
+
+def test_to_tiles_concurrent_add_source(tmp_path):
+    vrt = create_mosaic()
+    vrt.concurrent = True
+
+    def work(i):
+        if i % 10 == 0:
+            return len(vrt.to_tiles(tmp_path.joinpath(str(i)), 4, 4))
+        vrt.add_source(
+            1,
+            f"{i}.tif",
+            1,
+            src_win_xoff=0,
+            src_win_yoff=0,
+            src_win_xsize=16,
+            src_win_ysize=16,
+        )
+        return 16
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        assert set(executor.map(work, range(100))) == {16}
+
+    for i in range(0, 100, 10):
+        tile = tmp_path.joinpath(str(i), "tile_0_0.vrt")
+        assert ET.parse(tile).getroot().find("VRTRasterBand") is not None
+
+
+def test_to_tiles_invalid():
+    vrt = VRTWriter()
+    with pytest.raises(ValueError):
+        vrt.to_tiles("tiles", 8, 8)
+    vrt.add_vrtdataset(8, 8)
+    with pytest.raises(ValueError):
+        vrt.to_tiles("tiles", 0, 8)
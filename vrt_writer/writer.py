@@ -1,7 +1,13 @@
 """GDAL VRT writing classes and methods."""
 import itertools
+import json
+import math
+import os
 import pickle
+import threading
 import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Sequence
 from xml.sax import saxutils
@@ -37,6 +43,11 @@ def get_vrt_schema():
     return schema
 
 
+TileGrid = namedtuple(
+    "TileGrid", ["xsize", "ysize", "tile_xsize", "tile_ysize", "ncols", "nrows"]
+)
+
+
 def escape(s):
     """Escape a string for embeding in xml. For example required for WKT strings."""
     return saxutils.escape(s, entities={"'": "&apos;", '"': "&quot;"})
@@ -94,8 +105,27 @@ class VRTWriter:
         "dB2pow",
     )
 
-    def __init__(self):
+    def __init__(self, concurrent=False):
+        """Create an empty VRTDataset writer.
+
+        Every `add_source` call adds a source, and every `add_metadata` call adds or
+        replaces the Metadata of its domain. Within a band these are ordered by the
+        `order` argument, then by content, in both serial and concurrent mode, so the
+        same calls always produce the same VRTDataset. Since later sources paint over
+        earlier ones, pass `order` when compositing priority matters. Of several
+        Metadata with the same domain, the last one in that order wins.
+
+        Args:
+            concurrent (bool, optional): If True, `add_source` and `add_metadata` may be
+                called from many threads at once. Their elements are appended to per-band
+                buffers and merged into `vrt` on the next call to `flush`, `to_string`,
+                `to_file` or `is_valid`. Otherwise they are merged immediately. Defaults
+                to False.
+        """
         self.vrt = dict()
+        self.concurrent = concurrent
+        self._lock = threading.RLock()
+        self._buffers = {None: self._new_buffer()}
 
     def add_vrtdataset(self, xsize, ysize, subclass=None):
         """Add the root element of a VRTDataset.
@@ -212,23 +242,12 @@ class VRTWriter:
             {"@Projection": wkt, "@dataAxisToSRSAxisMapping": axis_mapping},
         )
 
-    def add_metadata(self, metadata, domain=None, band=None):
+    def add_metadata(self, metadata, domain=None, band=None, order=None):
         if not isinstance(metadata, dict):
             raise ValueError("metadata must be a mapping of key value pairs")
         if domain:
             if not isinstance(domain, str):
                 raise ValueError("domain must be a string representing metadata domain")
-        if band:
-            parent = list(
-                filter(lambda r: r["@band"] == band, self.vrt["VRTRasterBand"])
-            )
-            if len(parent) == 1:
-                parent = parent[0]
-            else:
-                raise ValueError(f"Could not add metadata to band {band}.")
-        else:
-            parent = None
-
         sub_element = {"MDI": []}
         if not domain:
             sub_element.update({"@domain": ""})
@@ -237,17 +256,19 @@ class VRTWriter:
         for key, val in metadata.items():
             sub_element["MDI"].append({"@key": key, "$": val})
 
-        self.update_element("Metadata", sub_element, parent=parent)
+        self.append_element("Metadata", sub_element, band=band, order=order)
 
     def add_vrtrasterband(self, band, dtype="Byte", subclass=None):
         if subclass is not None and subclass not in self.VRTRASTERBAND_SUBCLASSES:
             raise ValueError(f"Invalid subclass {subclass} for VRTRasterBand element.")
 
-        self.update_element(
-            "VRTRasterBand",
-            {"@band": band, "@dataType": dtype},
-            {"@subClass": subclass},
-        )
+        with self._lock:
+            self.update_element(
+                "VRTRasterBand",
+                {"@band": band, "@dataType": dtype},
+                {"@subClass": subclass},
+            )
+            self._buffers[band] = self._new_buffer()
 
     def add_pixelfunc(self, band, func):
         if func not in self.VRTRASTERBAND_PIX_FUNC:
@@ -361,9 +382,8 @@ class VRTWriter:
         relative=False,
         shared=True,
         open_options=None,
+        order=None,
     ):
-        parent = self.get_band_element(band)
-
         sub_element = {
             "SourceFilename": {
                 "@relativeToVRT": 1 if relative else 0,
@@ -420,11 +440,13 @@ class VRTWriter:
                 }
             )
 
-        self.update_element(f"{type}Source", sub_element, parent=parent)
+        self.append_element(f"{type}Source", sub_element, band=band, order=order)
 
     def to_string(self):
         """Return a string representation of VRTDataset."""
-        return ET.tostring(self.schema.encode(self.vrt))
+        self.flush()
+        with self._lock:
+            return ET.tostring(self.schema.encode(self.vrt))
 
     def to_file(self, path):
         """Write VRTDataset to file.
@@ -436,8 +458,309 @@ class VRTWriter:
         with path.open("wb") as f:
             f.write(self.to_string())
 
+    def to_tiles(
+        self, directory, tile_xsize, tile_ysize, vrt_path=None, max_workers=None
+    ):
+        """Split VRTDataset into a regular grid of tiles and write one VRTDataset per tile.
+
+        Each tile VRTDataset only holds the sources of each band, and of mask bands, that
+        intersect the tile, with their `SrcRect` and `DstRect` clipped to the tile and
+        `GeoTransform` shifted to the tile origin. Sources are assigned to tiles once from
+        their `DstRect`, so each tile only clips its own sources. Tiles are written in
+        parallel as `tile_<row>_<col>.vrt`, alongside an `index.json` listing the raster
+        size of the VRTDataset and the pixel window, and if available the GeoTransform,
+        of every tile. Band level `Overview` elements describe the whole VRTDataset and
+        are not written to tiles.
+
+        Args:
+            directory (str or Pathlike): Directory to write tiles and index to. Created if it
+                does not exist.
+            tile_xsize (int): Width in pixels of tiles. Tiles on the right edge may be
+                narrower.
+            tile_ysize (int): Height in pixels of tiles. Tiles on the bottom edge may be
+                shorter.
+            vrt_path (str or Pathlike, optional): Path the VRTDataset is, or will be,
+                written to. Filenames of sources with `relativeToVRT` set are resolved
+                against its directory and rewritten relative to `directory`. Required if
+                such sources exist. Defaults to None.
+            max_workers (int, optional): Maximum number of threads writing tiles. Defaults to
+                None, letting `ThreadPoolExecutor` choose.
+
+        Raises:
+            ValueError: If tile size is not positive or VRTDataset has no raster size.
+            ValueError: If VRTDataset is a VRTWarpedDataset or VRTPansharpenedDataset, or
+                has a VRTRawRasterBand, whose options describe the whole VRTDataset and
+                can not be clipped.
+            ValueError: If a source can not be clipped, either because it is a
+                KernelFilteredSource or because it has neither `SrcRect` nor
+                `SourceProperties` giving its size.
+            ValueError: If a source is relative to the VRT and `vrt_path` is None.
+
+        Returns:
+            (list): Index entries, one dict per tile in row-major order.
+        """
+        if tile_xsize <= 0 or tile_ysize <= 0:
+            raise ValueError("tile_xsize and tile_ysize must be positive integers.")
+
+        directory = Path(directory)
+        relative_to = None if vrt_path is None else (Path(vrt_path).parent, directory)
+
+        # Bucketing only copies references, so hold the lock while walking `vrt` rather
+        # than taking a deep copy of it.
+        with self._lock:
+            self.flush()
+            vrt = dict(self.vrt)
+            if "@rasterXSize" not in vrt or "@rasterYSize" not in vrt:
+                raise ValueError(
+                    "VRTDataset must have rasterXSize and rasterYSize to be split."
+                )
+            if vrt.get("@subClass") in self.VRTDATASET_SUBCLASSES:
+                raise ValueError(f"Can not split a {vrt['@subClass']} into tiles.")
+
+            xsize, ysize = vrt["@rasterXSize"], vrt["@rasterYSize"]
+            grid = TileGrid(
+                xsize=xsize,
+                ysize=ysize,
+                tile_xsize=tile_xsize,
+                tile_ysize=tile_ysize,
+                ncols=math.ceil(xsize / tile_xsize),
+                nrows=math.ceil(ysize / tile_ysize),
+            )
+            bands = [
+                self._bucket_band(band, grid, relative_to)
+                for band in self._as_list(vrt.get("VRTRasterBand", []))
+            ]
+            mask = self._bucket_mask(vrt, grid, relative_to)
+
+        directory.mkdir(parents=True, exist_ok=True)
+
+        def write_tile(tile):
+            row, col = tile
+            xoff, yoff = col * tile_xsize, row * tile_ysize
+            window = (
+                xoff,
+                yoff,
+                min(tile_xsize, xsize - xoff),
+                min(tile_ysize, ysize - yoff),
+            )
+            filename = f"tile_{row}_{col}.vrt"
+
+            writer = VRTWriter()
+            writer.vrt = self._clip_vrtdataset(vrt, bands, mask, tile, window)
+            writer.to_file(directory.joinpath(filename))
+
+            entry = dict(
+                zip(("filename", "xoff", "yoff", "xsize", "ysize"), (filename, *window))
+            )
+            if "GeoTransform" in writer.vrt:
+                entry["geotransform"] = [
+                    float(v) for v in writer.vrt["GeoTransform"]["$"].split(",")
+                ]
+            return entry
+
+        tiles = itertools.product(range(grid.nrows), range(grid.ncols))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            index = list(executor.map(write_tile, tiles))
+
+        with directory.joinpath("index.json").open("w") as f:
+            json.dump(
+                {"rasterXSize": xsize, "rasterYSize": ysize, "tiles": index},
+                f,
+                indent=2,
+            )
+
+        return index
+
+    @staticmethod
+    def _as_list(value):
+        return value if isinstance(value, list) else [value]
+
+    def _bucket_mask(self, node, grid, relative_to):
+        if "MaskBand" not in node:
+            return None
+        (band,) = self._as_list(node["MaskBand"]["VRTRasterBand"])
+
+        return self._bucket_band(band, grid, relative_to)
+
+    def _bucket_band(self, band, grid, relative_to):
+        """Assign sources of `band` to the tiles of `grid` their DstRect intersects.
+
+        Returns:
+            (tuple): Band without sources, overviews or mask, a dict mapping
+                `(row, col)` to `(element, source, src_rect, dst_rect)` tuples in band
+                order, and the mask band bucketed the same way, or None.
+        """
+        if band.get("@subClass") == "VRTRawRasterBand":
+            raise ValueError(
+                f"Can not clip VRTRawRasterBand {band.get('@band')} into tiles."
+            )
+
+        template = {
+            key: value
+            for key, value in band.items()
+            if not key.endswith("Source") and key not in ("Overview", "MaskBand")
+        }
+
+        buckets = dict()
+        for element, sources in band.items():
+            if not element.endswith("Source"):
+                continue
+            for source in self._as_list(sources):
+                src, dst = self._source_rects(element, source, (grid.xsize, grid.ysize))
+                dst_xoff, dst_yoff, dst_xsize, dst_ysize = dst
+                if dst_xsize <= 0 or dst_ysize <= 0:
+                    continue
+                source = self._relocate_source(source, relative_to)
+
+                cols = range(
+                    max(0, math.floor(dst_xoff / grid.tile_xsize)),
+                    min(
+                        grid.ncols, math.ceil((dst_xoff + dst_xsize) / grid.tile_xsize)
+                    ),
+                )
+                rows = range(
+                    max(0, math.floor(dst_yoff / grid.tile_ysize)),
+                    min(
+                        grid.nrows, math.ceil((dst_yoff + dst_ysize) / grid.tile_ysize)
+                    ),
+                )
+                for tile in itertools.product(rows, cols):
+                    buckets.setdefault(tile, []).append((element, source, src, dst))
+
+        return template, buckets, self._bucket_mask(band, grid, relative_to)
+
+    @staticmethod
+    def _source_rects(element, source, dataset_size):
+        """Return SrcRect and DstRect of `source` as `(xoff, yoff, xsize, ysize)` tuples.
+
+        Missing rects default as in GDAL: SrcRect to the whole source raster and DstRect
+        to the whole VRTDataset.
+        """
+        filename = source.get("SourceFilename", {}).get("$")
+        if element == "KernelFilteredSource":
+            raise ValueError(
+                f"Can not clip KernelFilteredSource {filename} without kernel padding."
+            )
+
+        keys = ("@xOff", "@yOff", "@xSize", "@ySize")
+        src = [source.get("SrcRect", {}).get(key) for key in keys]
+        dst = [source.get("DstRect", {}).get(key) for key in keys]
+
+        if src[2] is None or src[3] is None:
+            props = source.get("SourceProperties", {})
+            src = [0, 0, props.get("@RasterXSize"), props.get("@RasterYSize")]
+            if src[2] is None or src[3] is None:
+                raise ValueError(
+                    f"Can not clip source {filename}: no SrcRect or SourceProperties."
+                )
+        if dst[2] is None or dst[3] is None:
+            dst = [0, 0, *dataset_size]
+
+        return (
+            tuple(float(v or 0) for v in src),
+            tuple(float(v or 0) for v in dst),
+        )
+
+    @staticmethod
+    def _relocate_source(source, relative_to):
+        filename = source["SourceFilename"]
+        if str(filename.get("@relativeToVRT", 0)) != "1":
+            return source
+        if relative_to is None:
+            raise ValueError(
+                f"vrt_path is required to relocate relative source {filename['$']}."
+            )
+
+        vrt_directory, directory = relative_to
+        path = os.path.relpath(vrt_directory.joinpath(filename["$"]), directory)
+
+        return {**source, "SourceFilename": {**filename, "$": Path(path).as_posix()}}
+
+    def _clip_vrtdataset(self, vrt, bands, mask, tile, window):
+        xoff, yoff, xsize, ysize = window
+        clipped = {
+            key: value
+            for key, value in vrt.items()
+            if key not in ("VRTRasterBand", "Overview", "MaskBand")
+        }
+        clipped.update({"@rasterXSize": xsize, "@rasterYSize": ysize})
+
+        if "GeoTransform" in clipped:
+            gt = [float(v) for v in clipped["GeoTransform"]["$"].split(",")]
+            gt[0] += xoff * gt[1] + yoff * gt[2]
+            gt[3] += xoff * gt[4] + yoff * gt[5]
+            clipped["GeoTransform"] = {"$": ", ".join(map(str, gt))}
+        if "GCPList" in clipped:
+            gcps = clipped["GCPList"]
+            clipped["GCPList"] = {
+                **gcps,
+                "GCP": [
+                    {
+                        **gcp,
+                        "@Pixel": gcp["@Pixel"] - xoff,
+                        "@Line": gcp["@Line"] - yoff,
+                    }
+                    for gcp in self._as_list(gcps.get("GCP", []))
+                ],
+            }
+
+        if mask:
+            clipped["MaskBand"] = {"VRTRasterBand": self._clip_band(mask, tile, window)}
+        if bands:
+            clipped["VRTRasterBand"] = [
+                self._clip_band(band, tile, window) for band in bands
+            ]
+
+        return clipped
+
+    def _clip_band(self, band, tile, window):
+        template, buckets, mask = band
+        clipped = dict(template)
+        for element, source, src, dst in buckets.get(tile, []):
+            clipped_source = self._clip_source(source, src, dst, window)
+            if clipped_source is not None:
+                clipped.setdefault(element, []).append(clipped_source)
+        if mask:
+            clipped["MaskBand"] = {"VRTRasterBand": self._clip_band(mask, tile, window)}
+
+        return clipped
+
+    @staticmethod
+    def _clip_source(source, src, dst, window):
+        """Clip a source to `window`, returning None if they do not intersect."""
+        src_xoff, src_yoff, src_xsize, src_ysize = src
+        dst_xoff, dst_yoff, dst_xsize, dst_ysize = dst
+
+        xoff, yoff, xsize, ysize = window
+        x0, x1 = max(dst_xoff, xoff), min(dst_xoff + dst_xsize, xoff + xsize)
+        y0, y1 = max(dst_yoff, yoff), min(dst_yoff + dst_ysize, yoff + ysize)
+        if x0 >= x1 or y0 >= y1:
+            return None
+
+        xscale, yscale = src_xsize / dst_xsize, src_ysize / dst_ysize
+
+        return {
+            **source,
+            "SrcRect": {
+                "@xOff": src_xoff + (x0 - dst_xoff) * xscale,
+                "@yOff": src_yoff + (y0 - dst_yoff) * yscale,
+                "@xSize": (x1 - x0) * xscale,
+                "@ySize": (y1 - y0) * yscale,
+            },
+            "DstRect": {
+                "@xOff": float(x0 - xoff),
+                "@yOff": float(y0 - yoff),
+                "@xSize": float(x1 - x0),
+                "@ySize": float(y1 - y0),
+            },
+        }
+
     def get_band_element(self, band):
-        element = next(filter(lambda d: d["@band"] == band, self.vrt["VRTRasterBand"]))
+        with self._lock:
+            element = next(
+                filter(lambda d: d["@band"] == band, self.vrt.get("VRTRasterBand", [])),
+                None,
+            )
         if not element:
             raise ValueError(
                 f"VRTRasterBand corresponding to index {band} does not exist."
@@ -462,6 +785,10 @@ class VRTWriter:
         else:
             optional_mapping = dict()
 
+        with self._lock:
+            self._update_element(element, mapping, optional_mapping, parent)
+
+    def _update_element(self, element, mapping, optional_mapping, parent):
         if parent:
             node = parent
         else:
@@ -492,14 +819,95 @@ class VRTWriter:
         else:
             node.update({element: d})
 
+    def append_element(self, element, mapping, band=None, order=None):
+        """Add a repeatable element to the VRTDataset or to one of its bands.
+
+        The element is buffered under a lock private to `band`, so that threads adding to
+        different bands never contend with each other. Buffered elements are merged into
+        `vrt` by `flush`, which outside of concurrent mode happens immediately.
+
+        Args:
+            element (str): Name of VRT element to add.
+            mapping (dict): A dict containing attributes and subelements of `element`.
+            band (int, optional): Index of the VRTRasterBand to add `element` to. If None,
+                `element` is added to the VRTDataset. Defaults to None.
+            order (int, optional): Position of `element` among elements of the same
+                band. Elements with equal `order` are ordered by content. Defaults to None,
+                equivalent to 0.
+
+        Raises:
+            ValueError: If `band` does not exist.
+        """
+        try:
+            buffer = self._buffers[band]
+        except KeyError:
+            raise ValueError(
+                f"VRTRasterBand corresponding to index {band} does not exist."
+            )
+        key = (order or 0, *self._content_key(element, mapping))
+        with buffer["lock"]:
+            buffer["pending"].append((key, element, mapping))
+
+        if not self.concurrent:
+            with self._lock:
+                self._merge_buffer(band, buffer)
+
+    @staticmethod
+    def _new_buffer():
+        return {"lock": threading.Lock(), "pending": [], "merged": []}
+
+    @staticmethod
+    def _content_key(element, mapping):
+        if element == "Metadata":
+            head = (mapping["@domain"],)
+        else:
+            head = (str(mapping["SourceFilename"]["$"]), mapping["SourceBand"]["$"])
+
+        return (*head, json.dumps(mapping, sort_keys=True, default=str))
+
+    def flush(self):
+        """Merge elements buffered by concurrent `add_source` and `add_metadata` calls.
+
+        Every element ever buffered for a band is kept sorted by `order` and content, and
+        the band's sources and metadata are rebuilt from them, so the result does not
+        depend on when `flush` runs.
+        """
+        with self._lock:
+            for band, buffer in self._buffers.items():
+                self._merge_buffer(band, buffer)
+
+    def _merge_buffer(self, band, buffer):
+        with buffer["lock"]:
+            pending, buffer["pending"] = buffer["pending"], []
+        if not pending:
+            return
+
+        merged = buffer["merged"]
+        merged.extend(pending)
+        merged.sort(key=lambda e: e[0])
+
+        elements = dict()
+        for _, element, mapping in merged:
+            elements.setdefault(element, []).append(mapping)
+        if "Metadata" in elements:
+            domains = {m["@domain"]: m for m in elements["Metadata"]}
+            elements["Metadata"] = list(domains.values())
+
+        node = self.get_band_element(band) if band else self.vrt
+        node.update(elements)
+
     @property
     def is_valid(self):
+        self.flush()
         try:
-            self.schema.encode(self.vrt)
+            with self._lock:
+                self.schema.encode(self.vrt)
             return True
         except xmlschema.XMLSchemaEncodeError:
             return False
 
     def clear(self):
-        """Clear VRTDataset contents."""
-        self.vrt = dict()
+        """Clear VRTDataset contents, including any buffered elements."""
+        with self._lock:
+            self.vrt = dict()
+            self._buffers = {None: self._new_buffer()}